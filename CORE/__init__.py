@@ -22,38 +22,35 @@
 #
 #
 """Setup interaction with each tier"""
-import tiers
-import multiprocessing as multiproc
-import threading
+import tiers as tiers_mod
+import concurrent.futures as futures
 
 
 def init(tier_settings: dict, drive_settings: dict, tier_multiproc_settings: dict) -> None:
     """Setup and run intra- and inter-tier processing thread(s)"""
-    tiers = {}
+    workers = {}
     pipes = {}
+    # If whether to use threads or procs has not been defined, use threads
+    proc_tiers = [each for each in tier_settings if tier_multiproc_settings.get(each, False)]
+    thread_tiers = [each for each in tier_settings if each not in proc_tiers]
+    # manage_tier() does not return until the tier is shut down, so each tier needs a worker to itself
+    pools = {True: None, False: None}
+    if len(proc_tiers) > 0:
+        pools[True] = futures.ProcessPoolExecutor(max_workers=len(proc_tiers))
+    if len(thread_tiers) > 0:
+        pools[False] = futures.ThreadPoolExecutor(max_workers=len(thread_tiers))
+
     for each in tier_settings:
-        # If whether to use threads or procs has not been defined, use threads
         drives = {}
         for each1 in tier_settings[each]["drives"]:
             drives[each1] = drive_settings[each1]
-        _ = multiproc.Pipe(duplex=True)
-        pipes[each] = _[1]
-        if each in tier_multiproc_settings:
-            if tier_multiproc_settings[each]:
-                # using procs
-                tiers[each] = multiproc.Process(target=tiers.manage_tier, args=(tier_settings[each], drives, _[0]))
-            else:
-                # using threads
-                tiers[each] = threading.Thread(target=tiers.manage_tier, args=(tier_settings[each], drives, _[0]))
-
-        else:
-            tiers[each] = threading.Thread(target=tiers.manage_tier, args=(tier_settings[each], drives, _[0]))
+        tier_end, parent_end = tiers_mod.make_channel(each in proc_tiers)
+        pipes[each] = tiers_mod.TierPipe(parent_end)
+        workers[each] = pools[each in proc_tiers].submit(tiers_mod.manage_tier, tier_settings[each],
+                                                          drives, tier_end)
 
-    for each in tiers:
-        tiers[each].start()
     for each in pipes:
         pipes[each].send(["STARTUP"])
 
     # At this point, all our tiers are started up and initalized we can connect to our parent process and start accepting commands
 
-
@@ -25,26 +25,258 @@
 import tiers.fs_interface as fs_int
 import threading
 import queue
+import concurrent.futures as futures
 import _io
+import os
+import shutil
 import random as rand
 import time
+import heapq
+import pickle
+import logging
+import collections
+import copy
+import multiprocessing as multiproc
+import multiprocessing.connection as mp_conn
+from multiprocessing import shared_memory, resource_tracker
 
-def multicall_threader(*args, func=None, que=None, ignore_errors=False, **kwargs):
-    """Call the given function, with the given arguments.
+logger = logging.getLogger(__name__)
 
-    If queue is not None, return data back up the queue once the function exits.
+# Replies bigger than this (in bytes, once pickled) are handed off through shared memory
+# instead of being pushed through the pipe
+SHM_THRESHOLD = 32 * 1024
+# Most commands manage_tier() will pull off the pipe in one go
+MAX_BATCH = 64
+# Most commands the parent can have waiting on replies from a tier at once
+MAX_PENDING = 128
+# Shortest time (in seconds) manage_tier() will wait for commands before running maintenance
+# (index refreshes, dropping access points) again
+MAINTENANCE_INTERVAL = 0.1
+# How much of a file to move at once when copying between drives
+COPY_CHUNK_SIZE = 1024 ** 2
+
+
+def _copy_stream(src_stream, dest_stream) -> None:
+    """Copy one file stream into another, without reading the whole file into memory
+
+    Uses os.sendfile() where possible so the data never has to leave the kernel, otherwise
+    falls back to copying COPY_CHUNK_SIZE bytes at a time.
     """
-    if ignore_errors:
+    try:
+        src_fd = src_stream.fileno()
+        dest_fd = dest_stream.fileno()
+    except (AttributeError, OSError):
+        shutil.copyfileobj(src_stream, dest_stream, COPY_CHUNK_SIZE)
+        return
+    offset = 0
+    while True:
         try:
-            output = func(*args, **kwargs)
-        except as e:
-            output = None
-            print("Error occured on drive thread.")
-            print(e)
-    else:
-        output = func(*args, **kwargs)
-    if None not in (que, output):
-        que.put(output)
+            sent = os.sendfile(dest_fd, src_fd, offset, COPY_CHUNK_SIZE)
+        except OSError:
+            # If anything has already been written, we can't safely switch methods part way through
+            if offset > 0:
+                raise
+            shutil.copyfileobj(src_stream, dest_stream, COPY_CHUNK_SIZE)
+            return
+        if sent == 0:
+            return
+        offset += sent
+
+
+def _send_large(pipe, obj) -> None:
+    """Send an object down the pipe, using shared memory if it is large
+
+    Objects are pickled with protocol 5, so any pickle.PickleBuffer in them gets sent as its own frame
+    instead of being copied into the pickle. Plain bytes and bytearrays are still pickled in-band, so
+    wrap large payloads in pickle.PickleBuffer to skip the copy.
+
+    Small objects with nothing out-of-band go straight down the pipe. Otherwise, a header is sent first:
+        ("OOB", nbuffers): the pickle follows as the next frame
+        ("SHM", name, nbytes, nbuffers): the pickle is in a shared memory segment
+    followed by any out-of-band buffers. Shared memory segments belong to the receiving end once
+    the header is sent, and it frees them after reading them. Nothing is ever sent back, since the
+    other end may already have more commands on their way down the same pipe.
+    """
+    buffers = []
+    data = pickle.dumps(obj, protocol=5, buffer_callback=buffers.append)
+    if len(data) <= SHM_THRESHOLD:
+        if len(buffers) == 0:
+            # Connection.recv() just unpickles whatever it gets, so there's no need to pickle this twice
+            pipe.send_bytes(data)
+            return
+        pipe.send(("OOB", len(buffers)))
+        pipe.send_bytes(data)
+        for each in buffers:
+            pipe.send_bytes(each.raw())
+        return
+    shm = shared_memory.SharedMemory(create=True, size=len(data))
+    try:
+        shm.buf[:len(data)] = data
+        # Stop our resource tracker from unlinking the segment out from under the other end.
+        # This has to happen before the header goes out, or it could race with the other end registering it.
+        resource_tracker.unregister(shm._name, "shared_memory")
+        try:
+            pipe.send(("SHM", shm.name, len(data), len(buffers)))
+        except BaseException:
+            # The other end never heard of it, so it's still ours to free
+            resource_tracker.register(shm._name, "shared_memory")
+            shm.unlink()
+            raise
+    finally:
+        shm.close()
+    for each in buffers:
+        pipe.send_bytes(each.raw())
+
+
+def _recv_large(pipe):
+    """Receive an object sent with _send_large()"""
+    output = pipe.recv()
+    if not isinstance(output, tuple) or len(output) not in (2, 4) or output[0] not in ("OOB", "SHM"):
+        return output
+    if output[0] == "OOB":
+        data = pipe.recv_bytes()
+        buffers = [pipe.recv_bytes() for each in range(output[1])]
+        return pickle.loads(data, buffers=buffers)
+    buffers = [pipe.recv_bytes() for each in range(output[3])]
+    shm = shared_memory.SharedMemory(name=output[1])
+    try:
+        with shm.buf[:output[2]] as view:
+            output = pickle.loads(view, buffers=buffers)
+    finally:
+        # The segment is ours now, so we free it
+        shm.close()
+        shm.unlink()
+    return output
+
+
+class ChannelBase():
+    """One end of a two-way channel between a tier and its parent"""
+    def send(self, obj) -> None:
+        """Send an object to the other end"""
+        raise NotImplementedError()
+
+    def recv(self):
+        """Receive an object from the other end, blocking until one is available"""
+        raise NotImplementedError()
+
+    def poll(self) -> bool:
+        """Check if there is anything waiting to be received"""
+        raise NotImplementedError()
+
+    def wait(self, timeout=None) -> bool:
+        """Block until there is something to receive, or timeout seconds pass. True if there is something to receive."""
+        raise NotImplementedError()
+
+
+class PipeChannel(ChannelBase):
+    """Channel over a multiprocessing Pipe, for tiers running in their own process"""
+    def __init__(self, pipe) -> None:
+        """Wrap one end of a duplex Pipe"""
+        self.pipe = pipe
+
+    def send(self, obj) -> None:
+        """Send an object to the other end"""
+        _send_large(self.pipe, obj)
+
+    def recv(self):
+        """Receive an object from the other end, blocking until one is available"""
+        return _recv_large(self.pipe)
+
+    def poll(self) -> bool:
+        """Check if there is anything waiting to be received"""
+        return self.pipe.poll()
+
+    def wait(self, timeout=None) -> bool:
+        """Block until there is something to receive, or timeout seconds pass. True if there is something to receive."""
+        return len(mp_conn.wait([self.pipe], timeout=timeout)) > 0
+
+
+class DequeChannel(ChannelBase):
+    """Channel over a pair of deques, for tiers running in a thread
+
+    Objects are handed straight to the other end, without being pickled or going through the kernel.
+    Each deque only ever has one thread appending and one popping, which deques handle without locking.
+    """
+    def __init__(self, inbox: collections.deque, inbox_ready: threading.Event,
+                 outbox: collections.deque, outbox_ready: threading.Event) -> None:
+        """Set up one end of the channel"""
+        self.inbox = inbox
+        self.inbox_ready = inbox_ready
+        self.outbox = outbox
+        self.outbox_ready = outbox_ready
+
+    def send(self, obj) -> None:
+        """Send an object to the other end"""
+        self.outbox.append(obj)
+        self.outbox_ready.set()
+
+    def recv(self):
+        """Receive an object from the other end, blocking until one is available"""
+        while not self.wait():
+            pass
+        return self.inbox.popleft()
+
+    def poll(self) -> bool:
+        """Check if there is anything waiting to be received"""
+        return len(self.inbox) > 0
+
+    def wait(self, timeout=None) -> bool:
+        """Block until there is something to receive, or timeout seconds pass. True if there is something to receive."""
+        # Clear before checking, so anything sent after the check still wakes us up
+        self.inbox_ready.clear()
+        if len(self.inbox) > 0:
+            return True
+        self.inbox_ready.wait(timeout)
+        return len(self.inbox) > 0
+
+
+def make_channel(use_procs: bool) -> tuple:
+    """Make a channel between a tier and its parent
+
+    Returns (tier's end, parent's end). Set use_procs to True if the tier will be in its own process.
+    """
+    if use_procs:
+        tier_end, parent_end = multiproc.Pipe(duplex=True)
+        return PipeChannel(tier_end), PipeChannel(parent_end)
+    to_tier = collections.deque()
+    to_tier_ready = threading.Event()
+    to_parent = collections.deque()
+    to_parent_ready = threading.Event()
+    return (DequeChannel(to_tier, to_tier_ready, to_parent, to_parent_ready),
+            DequeChannel(to_parent, to_parent_ready, to_tier, to_tier_ready))
+
+
+class TierPipe():
+    """Parent's end of a tier's channel
+
+    Limits how many commands can be waiting on replies at once, so a busy tier pushes back on
+    whoever is sending it commands, instead of letting them pile up in the pipe.
+    """
+    def __init__(self, channel: ChannelBase, max_pending=MAX_PENDING) -> None:
+        """Wrap the parent's end of the channel"""
+        self.channel = channel
+        self.max_pending = max_pending
+        self.pending = 0
+
+    def send(self, command) -> None:
+        """Send a command to the tier
+
+        Raises queue.Full if too many commands are still waiting on replies. Read some replies and try again.
+        """
+        if self.pending >= self.max_pending:
+            raise queue.Full(f"{self.pending} commands are already waiting on replies from this tier.")
+        self.channel.send(command)
+        self.pending += 1
+
+    def recv(self):
+        """Get the reply to the oldest command still waiting on one"""
+        output = self.channel.recv()
+        self.pending = max(0, self.pending - 1)
+        return output
+
+    def poll(self, timeout=0.0) -> bool:
+        """Check if there is a reply waiting to be read"""
+        return self.channel.wait(timeout)
 
 
 class Tier():
@@ -54,18 +286,35 @@ class Tier():
         self.drives = {}
         for each in drive_settings:
             self.drives[drive_settings[each]["nickname"]] = fs_int.init(each, drive_settings[each])
+        # Name of the first drive, used whenever the tier only has one
+        self._first = next(iter(self.drives))
+        # Persistent pool for fanning drive operations out, so we aren't making new threads on every call
+        self._pool = futures.ThreadPoolExecutor(max_workers=max(2, len(self.drives)))
+        # Cached free space for each drive, and a max-heap of it so we can find the emptiest drive quickly.
+        # Rebuilt from the drives whenever _free_dirty is set.
+        self._free_space = {}
+        self._free_heap = []
+        self._free_dirty = True
+        # Drives whose cached free space needs re-reading before it's next used, see _update_free_space()
+        self._free_stale = set()
+        # Drives with more free space than available_space_file_limit, kept in step with the cache above
+        self._drives_with_space = set()
+        # Our own random number generator, so tiers in threads don't fight over the global one
+        self._rng = rand.Random()
 
-        self.tier_settings - tier_settings
+        self.tier_settings = tier_settings
 
     def index(self) -> None:
         """Index all drives"""
+        self._free_dirty = True
         if len(self.drives) > 1:
-            self.multithreader("refresh_index")
-        self.drives[self.drives.keys()[0]].refresh_index()
+            self._fan_out_all("refresh_index")
+        else:
+            self.drives[self._first].refresh_index()
 
     def get_drive_names(self):
         """Get drive names"""
-        return self.drives.keys()
+        return list(self.drives)
 
     def apply_index(self, index) -> bool:
         """Apply previously saved index"""
@@ -76,152 +325,265 @@ class Tier():
     def file_exists(self, file_path: str) -> bool:
         """Check if a file exists in this tier"""
         if len(self.drives) > 1:
-            return self.multithreader("check_file_exists", file_path)
-        return self.drives[self.drives.keys()[0]].check_file_exists(file_path)
+            return bool(self._fan_out_any("check_file_exists", file_path))
+        return self.drives[self._first].check_file_exists(file_path)
 
-    def open_file(self, file_path: str) -> _io.TextIOWrapper:
+    def open_file(self, file_path: str) -> _io.BufferedRandom:
         """Return file stream object for editing"""
         if len(self.drives) > 1:
-            return self.multithreader("open_file", file_path, ignore_errors=True)
+            return self._fan_out_any("open_file", file_path, ignore_errors=True)
         try:
-            return self.drives[self.drives.keys()[0]].open_file(file_path)
+            return self.drives[self._first].open_file(file_path)
         except FileNotFoundError:
             return None
 
-    def remove_file(self, file_path: str) -> bool:
-        """Delete file"""
-        if len(self.drives) > 1:
-            return self.multithreader("delete_file", file_path, ignore_errors=True)
-        try:
-            return self.drives[self.drives.keys()[0]].delete_file(file_path)
-        except FileNotFoundError:
-            return None
+    def remove_file(self, file_path: str) -> None:
+        """Delete file
 
-    def move_file(self, src_path: str, dest_path: src) -> bool:
+        Raises FileNotFoundError if no drive on this tier has it.
+        """
+        self._free_dirty = True
+        if len(self.drives) == 1:
+            return self.drives[self._first].delete_file(file_path)
+        # Checking the indexes is cheap, and tells us whether anything actually got deleted
+        resident_drives = [each for each in self.drives if self.drives[each].check_file_exists(file_path)]
+        if len(resident_drives) == 0:
+            raise FileNotFoundError(f"File {file_path} does not exist on this tier.")
+        futs = {each: self._pool.submit(self.drives[each].delete_file, file_path) for each in resident_drives}
+        for each in futs:
+            try:
+                futs[each].result()
+            except FileNotFoundError:
+                # Deleted out from under us, which is what we wanted anyway
+                pass
+            except Exception:
+                logger.exception("Error occured on drive thread for %s.", each)
+        return None
+
+    def move_file(self, src_path: str, dest_path: str) -> bool:
         """Move file"""
+        # The file can stay on whichever drive it's already on, so just rename it there
+        resident_drives = {each for each in self.drives if self.drives[each].check_file_exists(src_path)}
+        if len(resident_drives) == 0:
+            raise FileNotFoundError(f"File {src_path} does not exist on this tier.")
+        renamed_on = next(iter(resident_drives))
+        try:
+            self.drives[renamed_on].rename(src_path, dest_path)
+        except OSError:
+            # Couldn't rename in place (destination on another mount, etc), so copy it over instead
+            pass
+        else:
+            # Any other copies would be left behind at the old path
+            for each in resident_drives - {renamed_on}:
+                try:
+                    self.drives[each].delete_file(src_path)
+                except FileNotFoundError:
+                    pass
+                self._update_free_space(each, deferred=True)
+            return True
         self.copy_file(src_path, dest_path)
         self.remove_file(src_path)
+        return True
 
-    def copy_file(self, src_path: str, dest_path: src) -> bool:
+    def copy_file(self, src_path: str, dest_path: str) -> bool:
         """Copy file"""
         # Handle a single drive
         if len(self.drives) == 1:
-            if self.drives[self.drives.keys()[0]].get_free() > self.drives[self.drives.keys()[0]].get_node(src_path)["size"]:
-                return self.drives[self.drives.keys()[0]].copy_file(src_path, dest_path)
-            raise OSError(f"{self.self.drives.keys()[0]} has no space left.")
+            if self._get_free_space()[self._first] > self.drives[self._first].get_node(src_path)["size"]:
+                output = self.drives[self._first].copy_file(src_path, dest_path)
+                self._update_free_space(self._first)
+                return output
+            raise OSError(f"{self._first} has no space left.")
         # Handling multiple drives
+        # Ask every drive at once whether it has the file. Free space comes from our cache, unless
+        # it's out of date, in which case we ask for that in the same go.
+        want_free = self._free_dirty
+        probes = dict(zip(self.drives, self._pool.map(lambda drive: drive.probe(src_path, free=want_free),
+                                                      self.drives.values())))
+        if want_free:
+            self._set_free_space({each: probes[each]["free"] for each in probes})
+        free_space = self._get_free_space()
         # First, see which drives have the file on it, so we can get info about that file.
-        resident_drives = []
-        for each in self.drives:
-            if self.drives[each].check_file_exists(src_path):
-                resident_drives.append(each)
+        resident_drives = {each for each in probes if probes[each]["exists"]}
         if len(resident_drives) == 0:
             raise FileNotFoundError(f"File {src_path} does not exist on this tier.")
-        file_info = self.drives[resident_drives[0]].get_node(src_path)
+        file_info = probes[next(iter(resident_drives))]["node"]
         # Second, see if ANY drives have enough space for a new file. If not, just throw an error
-        allowed_drives = []
-        for each in self.drives:
-            if self.drives[each].get_free() > file_info["size"]:
-                allowed_drives.append(each)
+        allowed_drives = [each for each in probes if free_space[each] > file_info["size"]]
         if len(allowed_drives) == 0:
             raise OSError("No drives with enough space available on this tier.")
         # Below here, we know all drives in allowed_drives have enough space.
         # Check if allowed_drives and resident_drives have ANY drives that are the same. If they do, we can copy the drive on a single
         # drive, which will be faster that moving it between drives.
-        copied = False
-        for each in resident_drives:
-            for each1 in allowed_drives:
-                if each == each1:
-                    # We have a drive with both the file, and enough space for a copy
-                    return self.drives[each].copy_file(src_path, dest_path)
+        overlap = resident_drives.intersection(allowed_drives)
+        if len(overlap) > 0:
+            # We have a drive with both the file, and enough space for a copy
+            selected_drive = next(iter(overlap))
+            output = self.drives[selected_drive].copy_file(src_path, dest_path)
+            self._update_free_space(selected_drive)
+            return output
         # There are no drives with both the file, and enough space copy to another drive
         if self.tier_settings["fill_method"] == "largest_first":
-            space_amounts = {}
-            for each in allowed_drives:
-                space_amounts[each] = self.drives[each].get_free()
-            # we have the amount of free space on all the drives, now need to find out which has the most
-            most = ["", 0]
-            for each in space_amounts:
-                if space_amounts[each] > most[1]:
-                    most = [each, space_amounts[each]]
-            # We have the drive we want. Now to set the necessary variable
-            selected_drive = most[0]
+            # The emptiest drive is always allowed if any drive is
+            selected_drive = self._largest_drive()
         elif self.tier_settings["fill_method"] == "random":
-            selected_drive = rand.sample(allowed_drives, 1)[0]
+            selected_drive = self._rng.choice(allowed_drives)
         else:
-            print(f"Setting {self.tier_settings['fill_method']} not understood for 'fill_method', defaulting to random.")
-            selected_drive = rand.sample(allowed_drives, 1)[0]
-        src_stream = self.drive[resident_drives[0]].open_file(src_path)
-        dest_stream = self.drive[selected_drive].make_new_file(dest_path)
-        dest_stream.write(src_stream.read())
-        dest_stream.close()
-        src_stream.close()
+            logger.warning("Setting %s not understood for 'fill_method', defaulting to random.",
+                           self.tier_settings["fill_method"])
+            selected_drive = self._rng.choice(allowed_drives)
+        src_stream = self.drives[next(iter(resident_drives))].open_file(src_path)
+        dest_stream = self.drives[selected_drive].make_new_file(dest_path)
+        try:
+            _copy_stream(src_stream, dest_stream)
+        finally:
+            dest_stream.close()
+            src_stream.close()
+        # The new file was indexed while it was still empty
+        self.drives[selected_drive].refresh_node(dest_path)
+        self._update_free_space(selected_drive)
         return True
 
     def get_file_info(self, path) -> dict:
         """Copy file"""
         if len(self.drives) > 1:
-            return self.multithreader("get_node", path, ignore_errors=True)
+            return self._fan_out_any("get_node", path, ignore_errors=True)
         try:
-            return self.drives[self.drives.keys()[0]].get_node(path)
+            return self.drives[self._first].get_node(path)
         except FileNotFoundError:
             return None
 
-    def make_new_file(self, path: str) ->_io.TextIOWrapper:
+    def make_new_file(self, path: str) -> _io.BufferedWriter:
         """Make a new file on a random drive on this tier"""
-        if len(self.drives) > 1:
-            if self.drives[self.drives.keys()[0]].get_used() > self.tier_settings["available_space_file_limit"]:
-                return self.drives[self.drives.keys()[0]].make_new_file(path)
-            raise OSError(f"{self.self.drives.keys()[0]} has no space left.")
-        # Drives with enough space on them for the new file
-        allowed_drives = []
-        for each in self.drives:
-            if self.drives[each].get_used() > self.tier_settings["available_space_file_limit"]:
-                allowed_drives.append(each)
-        if len(allowed_drives) == 0:
-            raise OSError("No drives with enough space available on this tier.")
-        lucky_drive = rand.sample(allowed_drives, 1)[0]
-        return self.drives[lucky_drive].make_new_file(path)
-
+        self._get_free_space()
+        if len(self._drives_with_space) == 0:
+            # Our cache might just be out of date, so check with the drives before giving up
+            self._free_dirty = True
+            self._get_free_space()
+            if len(self._drives_with_space) == 0:
+                raise OSError("No drives with enough space available on this tier.")
+        lucky_drive = self._rng.choice(tuple(self._drives_with_space))
+        output = self.drives[lucky_drive].make_new_file(path)
+        # Nothing has been written to the file yet, so asking the drive now would give us a number
+        # that's about to be wrong. Check that drive again next time instead.
+        self._update_free_space(lucky_drive, deferred=True)
+        return output
 
     def dump_index(self) -> dict:
         """Dump master index"""
-        master_index = {}
-        for each in self.drives:
-            master_index[each] = self.drives[each].get_index()
-            self.drives[each].detach()
-        return master_index
+        # get_index() hands back read-only views, which can't be pickled. The nested dicts
+        # under them can, so a shallow copy is enough to get them through a channel.
+        return {name: dict(index) for name, index in self._fan_out_all("get_index").items()}
 
     def shut_down(self) -> dict:
         """Detatch all drives, dumping their indexs"""
         master_index = self.dump_index()
+        self._fan_out_all("detach")
+        self._pool.shutdown(wait=True)
         del self
         return master_index
 
-    def multithreader(self, func, *args, use_queue=True, **kwargs):
-        """Arbirtary multithreading function"""
-        threads = {}
-        for each in self.drives:
-            function = getattr(self.drives[each], func)
-            if use_queue:
-                que = queue.Queue()
-                threads[each] = [threading.Thread(target=multicall_threader,
-                                                  args=(*args,),
-                                                  kwargs=dict({"func": function,
-                                                               "que": que}, **kwargs)),
-                                 que]
-            else:
-                threads[each] = [threading.Thread(target=multicall_threader,
-                                                  args=(*args,),
-                                                  kwargs=dict({"func": function}, **kwargs))]
-            threads[each][0].start()
-        for each in threads:
-            if not threads[each][0].is_alive():
-                threads[each][0].join()
-        if use_queue():
-            for each in threads:
-                if not threads[each][1].empty():
-                    return threads[each][1].get()
+    def _fan_out_any(self, func, *args, ignore_errors=False, **kwargs):
+        """Run the given drive method on all drives at once, returning the first truthy result
+
+        Drives that haven't started yet by then are cancelled. Ones already running are left to finish,
+        since threads can't be stopped, but we don't wait on them.
+        """
+        futs = {self._pool.submit(getattr(self.drives[each], func), *args, **kwargs): each for each in self.drives}
+        try:
+            for each in futures.as_completed(futs):
+                try:
+                    output = each.result()
+                except FileNotFoundError:
+                    if not ignore_errors:
+                        raise
+                    # Not on this drive, nothing worth logging
+                    continue
+                except Exception:
+                    if not ignore_errors:
+                        raise
+                    logger.exception("Error occured on drive thread for %s.", futs[each])
+                    continue
+                if output:
+                    return output
+        finally:
+            for each in futs:
+                each.cancel()
+        return None
+
+    def _fan_out_all(self, func, *args, ignore_errors=False, **kwargs) -> dict:
+        """Run the given drive method on all drives at once, and return {drive name: result}
+
+        With ignore_errors, drives that raised an error get a result of None.
+        """
+        futs = {each: self._pool.submit(getattr(self.drives[each], func), *args, **kwargs) for each in self.drives}
+        output = {}
+        for each in futs:
+            try:
+                output[each] = futs[each].result()
+            except FileNotFoundError:
+                if not ignore_errors:
+                    raise
+                output[each] = None
+            except Exception:
+                if not ignore_errors:
+                    raise
+                logger.exception("Error occured on drive thread for %s.", each)
+                output[each] = None
+        return output
+
+    def _get_free_space(self) -> dict:
+        """Get free space on every drive, only asking the drives if our cache is out of date"""
+        if self._free_dirty:
+            # Ask all the drives at once
+            self._set_free_space(dict(zip(self.drives, self._pool.map(lambda drive: drive.get_free(),
+                                                                      self.drives.values()))))
+        while len(self._free_stale) > 0:
+            self._update_free_space(self._free_stale.pop())
+        return self._free_space
+
+    def _set_free_space(self, free_space: dict) -> None:
+        """Replace our cached free space for every drive"""
+        self._free_space = free_space
+        self._free_heap = [(-self._free_space[each], each) for each in self._free_space]
+        heapq.heapify(self._free_heap)
+        limit = self.tier_settings["available_space_file_limit"]
+        self._drives_with_space = {each for each in self._free_space if self._free_space[each] > limit}
+        self._free_dirty = False
+        self._free_stale.clear()
+
+    def _update_free_space(self, drive: str, deferred=False) -> None:
+        """Refresh cached free space for a single drive after writing to it
+
+        With deferred, the drive is only marked to be re-read the next time free space is needed,
+        for when it's about to be written to and asking now would be pointless.
+        """
+        if self._free_dirty:
+            # Everything gets re-read next time anyways
+            return
+        if deferred:
+            self._free_stale.add(drive)
+            return
+        self._free_space[drive] = self.drives[drive].get_free()
+        if self._free_space[drive] > self.tier_settings["available_space_file_limit"]:
+            self._drives_with_space.add(drive)
+        else:
+            self._drives_with_space.discard(drive)
+        if len(self._free_heap) >= 2 * len(self.drives):
+            # Too many out of date entries have built up, rebuild from the cache
+            self._free_heap = [(-self._free_space[each], each) for each in self._free_space]
+            heapq.heapify(self._free_heap)
+        else:
+            heapq.heappush(self._free_heap, (-self._free_space[drive], drive))
+
+    def _largest_drive(self) -> str:
+        """Get the name of the drive with the most free space"""
+        self._get_free_space()
+        # Drives that changed got a new entry pushed, rather than having their old one removed.
+        # Throw out old entries until the top one is current.
+        while -self._free_heap[0][0] != self._free_space[self._free_heap[0][1]]:
+            heapq.heappop(self._free_heap)
+        return self._free_heap[0][1]
 
     def get_index_ages(self):
         """Get ages of all drive indexs"""
@@ -233,70 +595,130 @@ class Tier():
     def drop_access_points(self):
         """Drop access points on all files in all drives"""
         if len(self.drives) > 1:
-            return self.multithreader("drop_access_points", use_queue=False)
-        return self.drives[self.drives.keys()[0]].drop_access_points()
+            self._fan_out_all("drop_access_points")
+            return None
+        return self.drives[self._first].drop_access_points()
+
+
+def _delete_file(tier_obj, path: str):
+    """Delete a file, turning a missing file into an error reply"""
+    try:
+        return tier_obj.remove_file(path)
+    except FileNotFoundError:
+        return {"ERROR": "FILE_NOT_FOUND"}
+
 
+# Every command besides STARTUP and SHUTDOWN. Handlers get the tier object and the full command.
+_HANDLERS = {
+    "GET_FILE_INFO": lambda tier_obj, command: tier_obj.get_file_info(command[1]),
+    "OPEN_FILE": lambda tier_obj, command: tier_obj.open_file(command[1]),
+    "MAKE_NEW_FILE": lambda tier_obj, command: tier_obj.make_new_file(command[1]),
+    "COPY_FILE": lambda tier_obj, command: tier_obj.copy_file(command[1][0], command[1][1]),
+    "MOVE_FILE": lambda tier_obj, command: tier_obj.move_file(command[1][0], command[1][1]),
+    "DELETE_FILE": lambda tier_obj, command: _delete_file(tier_obj, command[1]),
+    "EXISTS": lambda tier_obj, command: tier_obj.file_exists(command[1]),
+    "DUMP_INDEX": lambda tier_obj, command: tier_obj.dump_index(),
+    "REFRESH_INDEX": lambda tier_obj, command: tier_obj.index(),
+    "APPLY_SAVED_INDEX": lambda tier_obj, command: tier_obj.apply_index(command[1]),
+    "GET_DRIVE_NAMES": lambda tier_obj, command: {"DRIVE_NAMES": tier_obj.get_drive_names()},
+}
+_ALIASES = {
+    "NEW_FILE": "MAKE_NEW_FILE",
+    "REMOVE_FILE": "DELETE_FILE",
+    "REMOVE": "DELETE_FILE",
+    "DELETE": "DELETE_FILE",
+    "START": "STARTUP",
+    "INIT": "STARTUP",
+}
+# Commands that only read from the tier. Repeats of these within a batch are only run once,
+# as long as nothing that could change the tier was run in between.
+_READ_ONLY = ("GET_FILE_INFO", "EXISTS")
+# Commands whose replies point into the tier's live index. Over a DequeChannel these have to be
+# copied, since nothing gets pickled on the way, and the caller would otherwise share the tier's index.
+_LIVE_REPLIES = ("GET_FILE_INFO", "DUMP_INDEX")
+# Every command and alias -> (command name, handler), so dispatching a command is a single lookup.
+# STARTUP and SHUTDOWN are handled by manage_tier() itself.
+_DISPATCH = {"STARTUP": ("STARTUP", None), "SHUTDOWN": ("SHUTDOWN", None)}
+_DISPATCH.update({name: (name, _HANDLERS[name]) for name in _HANDLERS})
+_DISPATCH.update({alias: _DISPATCH[_ALIASES[alias]] for alias in _ALIASES})
 
-def manage_tier(tier_settings: dict, drive_settings: dict, pipe) -> None:
+
+def manage_tier(tier_settings: dict, drive_settings: dict, channel: ChannelBase) -> None:
     """This function is meant to be run as it's own process it will not usually exit unless it receives
-       a command to do so in the pipe
+       a command to do so in the channel
     """
     tier_obj = None
     prev_drop_time = 0
+    copy_replies = isinstance(channel, DequeChannel)
+    drop_thread = None
     while True:
-        if not pipe.poll():
+        if tier_obj is None:
+            # Nothing to maintain until we are started up
+            timeout = None
+        else:
+            # Sleep until either a command comes in, or the next bit of maintenance is due
+            next_refresh = min(tier_obj.get_index_ages().values()) + tier_settings["max_index_age"]
+            next_drop = prev_drop_time + tier_settings["drop_time"]
+            timeout = max(MAINTENANCE_INTERVAL, min(next_refresh, next_drop) - time.time())
+        if not channel.wait(timeout):
+            now = time.time()
             # Refresh indexes if needed
             index_times = tier_obj.get_index_ages()
-            cur = time.time()
             threads = []
             for each in index_times:
-                if (cur - index_times[each]) >= tier_settings["max_index_age"]:
+                if (now - index_times[each]) >= tier_settings["max_index_age"]:
                     threads.append(threading.Thread(target=tier_obj.drives[each].refresh_index))
                     threads[-1].start()
             for each in threads:
-                if not threads[each].is_alive():
-                    threads[each].join()
+                each.join()
+            # Files we handed out may have been written to since, so check free space again next time
+            tier_obj._free_dirty = True
 
             # Check if access points need to be dropped
-            if (time.time() - prev_drop_time) >= tier_settings["drop_time"]:
-                # Drop access points
-            if (time.time() - cur) < 0.005:
-                time.sleep(0.005)
+            # If the last drop is still going, leave this one until it's done
+            if (now - prev_drop_time) >= tier_settings["drop_time"] and (drop_thread is None or not drop_thread.is_alive()):
+                # Drop access points in the background, so we can keep handling commands.
+                # This gets its own thread, not tier_obj._pool, since it fans out onto that pool and waits on it.
+                drop_thread = threading.Thread(target=tier_obj.drop_access_points)
+                drop_thread.start()
+                prev_drop_time = now
             continue
-        command = pipe.recv()
-        if command[0].upper() == "GET_FILE_INFO":
-            pipe.send(tier_obj.get_file_info(command[1]))
-        elif command[0].upper() == "OPEN_FILE":
-            pipe.send(tier_obj.open_file(command[1]))
-        elif command[0].upper() in ("MAKE_NEW_FILE", "NEW_FILE"):
-            pipe.send(tier_obj.make_new_file(command[1]))
-        elif command[0].upper() == "COPY_FILE":
-            pipe.send(tier_obj.copy_file(command[1][0], command[1][1]))
-        elif command[0].upper() == "MOVE_FILE":
-            pipe.send(tier_obj.move_file(command[1][0], command[1][1]))
-        elif command[0].upper() in ("DELETE_FILE", "REMOVE_FILE", "REMOVE", "DELETE"):
-            try:
-                tier_obj.remove_file(command[1])
-            except FileNotFoundError:
-                pipe.send({"ERROR": "FILE_NOT_FOUND"})
-        elif command[0].upper() == "EXISTS":
-            pipe.send(tier_obj.check_file_exists(command[1]))
-        elif command[0].upper() == "SHUTDOWN":
-            index = tier_obj.shut_down()
-            pipe.send(index)
-            pipe.send({"SHUTDOWN": True})
-            break
-        elif command[0].upper() == "DUMP_INDEX":
-            index = tier_obj.dump_index()
-            pipe.send(index)
-        elif command[0].upper() == "REFRESH_INDEX":
-            pipe.send(tier_obj.index())
-        elif command[0].upper() == "APPLY_SAVED_INDEX":
-            pipe.send(tier_obj.apply_index(command[1]))
-        elif command[0].upper() == "GET_DRIVE_NAMES":
-            pipe.send({"DRIVE_NAMES": tier_obj.get_drive_names()})
-        elif command[0].upper() in ("STARTUP", "INIT", "START"):
-            tier_obj = Tier(tier_settings, drive_settings)
-            pipe.send(True)
-        else:
-            pipe.send({"ERROR": "COMMAND_NOT_RECOGNIZED"})
+        # Drain everything that's waiting, so a burst of commands costs one wake up, not one each
+        batch = []
+        while channel.poll() and len(batch) < MAX_BATCH:
+            batch.append(channel.recv())
+        # Replies still go back one per command, in order, so callers don't need to know how commands got batched
+        cache = {}
+        for command in batch:
+            name = command[0]
+            # Commands should already be upper case, in which case we can skip making a new string
+            entry = _DISPATCH.get(name if name.isupper() else name.upper())
+            if entry is None:
+                channel.send({"ERROR": "COMMAND_NOT_RECOGNIZED"})
+                continue
+            name, handler = entry
+            if name == "STARTUP":
+                tier_obj = Tier(tier_settings, drive_settings)
+                # drop_time counts from when the tier starts
+                prev_drop_time = time.time()
+                channel.send(True)
+            elif name == "SHUTDOWN":
+                if drop_thread is not None:
+                    drop_thread.join()
+                index = tier_obj.shut_down()
+                channel.send(index)
+                channel.send({"SHUTDOWN": True})
+                return
+            else:
+                if name in _READ_ONLY:
+                    key = (name, command[1])
+                    if key not in cache:
+                        cache[key] = handler(tier_obj, command)
+                    reply = cache[key]
+                else:
+                    # This might change the tier, so earlier reads can't be reused
+                    cache.clear()
+                    reply = handler(tier_obj, command)
+                if copy_replies and name in _LIVE_REPLIES:
+                    reply = copy.deepcopy(reply)
+                channel.send(reply)
@@ -26,24 +26,45 @@ import psutil
 import os
 import json
 import subprocess as subproc
+import functools
+import importlib
+
+# Which interface module handles which filesystem. Anything not listed here uses etc.
+_FS_MODULES = {
+    "ntfs": "tiers.fs_interface.ntfs",
+    "ext4": "tiers.fs_interface.ext4",
+    "zfs": "tiers.fs_interface.zfs",
+}
+
+
+@functools.lru_cache(maxsize=1)
+def _lsblk_all() -> dict:
+    """Get the filesystem of every block device on the system, with a single lsblk call
+
+    Returns a dictionary of device path -> filesystem type (or None if it has none)
+    """
+    devices = json.loads(subproc.check_output(["lsblk", "--json", "--list", "--output", "PATH,FSTYPE"]))
+    return {each["path"]: each["fstype"] for each in devices["blockdevices"]}
+
+
+def _get_fstype(drive: str):
+    """Get the filesystem type for a drive"""
+    drive = os.path.realpath(drive)
+    if drive not in _lsblk_all():
+        # Might have been plugged in since we last checked
+        _lsblk_all.cache_clear()
+        if drive not in _lsblk_all():
+            raise FileNotFoundError(f"Drive not found: {drive}")
+    return _lsblk_all()[drive]
 
 
 def init(drive: str, settings: dict):
     """Dynamically create FileSystem() class for given file systems"""
     if drive.lower() != "ramdisk":
-        try:
-            parts = json.loads(subproc.check_output(["lsblk", "--json", "--output", "fstype", drive]))
-        except subproc.CalledProcessError:
-            raise FileNotFoundError(f"Drive not found: {drive}")
-        parts = parts["blockdevices"][0]
-        if parts["fstype"].lower() == "ntfs":
-            import tiers.fs_interface.ntfs as fs
-        elif parts["fstype"].lower() == "ext4":
-            import tiers.fs_interface.ext4 as fs
-        elif parts["fstype"].lower() == "zfs":
-            import tiers.fs_interface.zfs as fs
-        else:
-            import tiers.fs_interface.etc as fs
+        fstype = _get_fstype(drive)
+        if fstype is None:
+            fstype = ""
+        fs = importlib.import_module(_FS_MODULES.get(fstype.lower(), "tiers.fs_interface.etc"))
     else:
         import tiers.fs_interface.ramdisk as fs
 
@@ -56,10 +77,12 @@ def init(drive: str, settings: dict):
         def __init__(self, settings: dict) -> None:
             """Initialize"""
             if settings["volatile"] or (settings["drive"].lower() == "ramdisk"):
-                super().__init__(settings["size"], settings["units"], settings["mount_point"])
+                super().__init__(settings["size"], settings["units"], settings["mount_point"],
+                                 index_workers=settings.get("index_workers", 1))
                 self.is_ramdisk = True
             else:
-                super().__init__(settings["drive"], settings["mount_point"])
+                super().__init__(settings["drive"], settings["mount_point"],
+                                 index_workers=settings.get("index_workers"))
                 self.is_ramdisk = False
 
 
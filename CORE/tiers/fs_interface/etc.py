@@ -23,49 +23,76 @@
 #
 """File System Interface for miscilaneous other filesystems"""
 import os
+import json
+import stat
+import sys
 import subprocess as subproc
 import copy
 import magic
 import shutil
 import _io
 import time
+import types
+import threading
+import concurrent.futures as futures
+try:
+    import orjson
+except ImportError:
+    orjson = None
 
 # TODO: Create function to check presence of file in index. Check for speed against os.path.exists()
 
-def recursive_mkdir(path):
-    """ Recursively make directories down a file path
+# If we can scan a folder through an open file descriptor, stat() calls on its entries only
+# have to look up one name, instead of resolving the whole path from / every time
+SCANDIR_FD = os.scandir in os.supports_fd
 
-    This function is functionally equivallent to: `mkdir -p {path}'
-    """
-    path = path.split("/")
-    for each in enumerate(path):
-        dir = "/".join(path[:each[0] + 1])
-        # prevent calling mkdir() on an empty string
-        if dir != "":
-            try:
-                os.mkdir(dir)
-            except FileExistsError:
-                pass
+# How many files each background MIME detection job handles. Small enough that a detach doesn't
+# have to wait long for jobs already running, big enough that queueing them is cheap.
+MIME_BATCH = 256
+
+# Where each drive's index gets saved when it is detached, relative to its mountpoint
+INDEX_CACHE_FILE = ".pytierfs_index.json"
+INDEX_CACHE_VERSION = 2
 
 class Interface():
     """Interface for most file systems"""
-    def __init__(self, drive: str, mountpoint: str, index=True):
-        """Initialize file system"""
+    def __init__(self, drive: str, mountpoint: str, index=True, index_workers=None):
+        """Initialize file system
+
+        index_workers is how many threads to index the drive with. Defaults to 4 per CPU core, up to 32.
+        """
         # mount drive
         self.prefix = mountpoint
+        # Every path lookup goes through _get_relative_path(), so work these out once
+        self._prefix_with_slash = mountpoint if mountpoint.endswith("/") else mountpoint + "/"
+        self._prefix_len = len(self._prefix_with_slash)
         self.drive = drive
+        if index_workers is None:
+            index_workers = min(32, (os.cpu_count() or 1) * 4)
+        self.index_workers = index_workers
         self._check_connected()
         self.made_mountpoint = False
         if not os.path.exists(mountpoint):
-            recursive_mkdir(mountpoint)
+            os.makedirs(mountpoint, exist_ok=True)
             self.made_mountpoint = True
         if not os.path.isdir(mountpoint):
             raise FileNotFoundError(f"Directory {mountpoint} is actually a file.")
         self._mount()
         self.index = {}
+        # Every node in the index, by relative path, so lookups don't have to walk the tree
+        self._by_path = {}
         self.index_time = 0
+        # Loading the magic database is slow, so keep one around per thread, see _get_magic().
+        # MIME types get filled in in the background after indexing, so indexing doesn't have to open every file.
+        # The pool lives as long as we do, so its threads (and their magic.Magic) get reused between refreshes.
+        self._mime = threading.local()
+        self._mime_pool = futures.ThreadPoolExecutor(max_workers=self.index_workers)
+        self._mime_futures = []
+        # Relative paths of files still waiting on a MIME type. Kept out of the nodes themselves,
+        # so it never shows up in anything we hand out or save.
+        self._mime_pending = set()
         # if we already have an index to load, don't make a new one.
-        if index:
+        if index and not self._refresh_from_cache():
             self.refresh_index()
         self.calc_size()
 
@@ -84,9 +111,9 @@ class Interface():
         except subproc.CalledProcessError:
             subproc.check_call(["mount", drive, mountpoint])
 
-    def get_index(self) -> dict:
-        """Return index for the entire drive"""
-        return copy.deepcopy(self.index)
+    def get_index(self) -> types.MappingProxyType:
+        """Return a read-only view of the index for the entire drive"""
+        return types.MappingProxyType(self.index)
 
     def refresh_index(self) -> None:
         """Refresh drive index. True if successful, false otherwise
@@ -106,174 +133,420 @@ class Interface():
 
         The key will be the file or folder name
         """
-        def index_folder_single(path: str) -> dict:
-            """Index a folder"""
-            if os.path.isfile(path):
-                return {"type": "file", "path": path}
-            contents = os.walk(path)
-            output = {}
-            count = 0
-            for each in contents:
-                if count == 0:
-                    for each1 in each[1]:
-                        output[each1] = {"type": "dir"}
-                        if path[-1] == "/":
-                            output[each1]["path"] = path + each1
-                        else:
-                            output[each1]["path"] = path + "/" + each1
-                        try:
-                            stat = os.stat(output[each1]["path"])
-                        except FileNotFoundError:
-                            stat = [None] * 10
-                        output[each1]["size"] = stat[6]
-                        output[each1]["uid"] = stat[4]
-                        output[each1]["gid"] = stat[5]
-                        output[each1]["atime"] = stat[7]
-                        output[each1]["mtime"] = stat[8]
-                        output[each1]["ctime"] = stat[9]
-                    for each1 in each[2]:
-                        output[each1] = {"type": "file"}
-                        if path[-1] == "/":
-                            output[each1]["path"] = path + each1
-                        else:
-                            output[each1]["path"] = path + "/" + each1
-                        try:
-                            stat = os.stat(output[each1]["path"])
-                        except FileNotFoundError:
-                            stat = [None] * 10
-                        output[each1]["size"] = stat[6]
-                        output[each1]["uid"] = stat[4]
-                        output[each1]["gid"] = stat[5]
-                        output[each1]["atime"] = stat[7]
-                        output[each1]["mtime"] = stat[8]
-                        output[each1]["ctime"] = stat[9]
-                        output[each1]["access_count"] = 0
-                        try:
-                            output[each1]["file_type"] = magic.from_file(output[each1]["path"], mime=True)
-                        except OSError:
-                            output[each1]["file_type"] = None
-                    break
-            return output
-
-
-        def index(starter_index: dir) -> dir:
-            for each in starter_index:
-                if starter_index[each]["type"] == "dir":
-                    starter_index[each]["contents"] = index_folder_single(starter_index[each]["path"])
-            for each in starter_index:
-                if starter_index[each]["type"] == "dir":
-                    starter_index[each]["contents"] = index(starter_index[each]["contents"])
-            return starter_index
-
-        self.index = index_folder_single(self.prefix)
-        self.index = index(self.index)
+        if self.index_workers > 1:
+            self.index, self._by_path = self._scan_parallel(self.prefix)
+        else:
+            self.index, self._by_path = self._scan(self.prefix)
         self.index_time = time.time()
+        self._fill_mime()
+
+    def _scan(self, path: str) -> tuple:
+        """Index a folder, and everything under it
+
+        Returns the index, and a {relative path: node} lookup table for it
+        """
+        output = {}
+        by_path = {}
+        folders = self._scan_folder(path, output, by_path)
+        while len(folders) > 0:
+            folders.extend(self._scan_folder(*folders.pop(), by_path))
+        return output, by_path
+
+    def _scan_parallel(self, path: str) -> tuple:
+        """Index a folder, and everything under it, scanning several folders at once
+
+        Scanning is mostly waiting on the drive, and the GIL is released while we do, so this scales with threads
+        Returns the same as _scan()
+        """
+        output = {}
+        by_path = {}
+        with futures.ThreadPoolExecutor(max_workers=self.index_workers) as pool:
+            pending = {pool.submit(self._scan_folder, path, output, by_path)}
+            while len(pending) > 0:
+                done, pending = futures.wait(pending, return_when=futures.FIRST_COMPLETED)
+                for each in done:
+                    for each1 in each.result():
+                        pending.add(pool.submit(self._scan_folder, *each1, by_path))
+        return output, by_path
+
+    def _scan_folder(self, path: str, output: dict, by_path: dict) -> list:
+        """Index the contents of a single folder into output, without going into sub-folders
+
+        Each node also gets added to by_path, under its path relative to the drive.
+        Uses os.scandir(), which already knows whether each entry is a folder, and caches stat() results.
+        Where supported, the folder is scanned through a file descriptor, so stat() is relative to it.
+        Returns a list of (path, contents dict) for each sub-folder, which still need to be scanned.
+        Each contents dict is only ever written to by whoever scans that folder, so no locking is needed.
+        """
+        folders = []
+        prefix_len = self._prefix_len
+        base = path if path.endswith("/") else path + "/"
+        # Our own saved index shouldn't end up in the index
+        skip = (INDEX_CACHE_FILE, INDEX_CACHE_FILE + ".tmp") if base == self._prefix_with_slash else ()
+        dir_fd = None
+        try:
+            if SCANDIR_FD:
+                dir_fd = os.open(path, os.O_RDONLY | os.O_DIRECTORY)
+                entries = os.scandir(dir_fd)
+            else:
+                entries = os.scandir(path)
+        except OSError:
+            if dir_fd is not None:
+                os.close(dir_fd)
+            # Can't read this folder, treat it as empty like os.walk() would
+            return folders
+        try:
+            with entries:
+                for each in entries:
+                    if each.name in skip:
+                        continue
+                    try:
+                        info = each.stat(follow_symlinks=False)
+                    except FileNotFoundError:
+                        # Deleted while we were indexing
+                        continue
+                    # Entries from a file descriptor only know their own name
+                    full_path = base + each.name
+                    node = {"path": full_path,
+                            "size": info.st_size,
+                            "uid": info.st_uid,
+                            "gid": info.st_gid,
+                            "atime": info.st_atime,
+                            "mtime": info.st_mtime,
+                            "ctime": info.st_ctime}
+                    if each.is_dir(follow_symlinks=False):
+                        node["type"] = "dir"
+                        node["contents"] = {}
+                        folders.append((full_path, node["contents"]))
+                    else:
+                        node["type"] = "file"
+                        node["access_count"] = 0
+                        # Filled in later by _fill_mime() or _detect_mime()
+                        node["file_type"] = None
+                    output[each.name] = node
+                    by_path[full_path[prefix_len:]] = node
+        finally:
+            if dir_fd is not None:
+                os.close(dir_fd)
+        return folders
+
+    def _save_index_cache(self) -> None:
+        """Save the index to the drive, so next time it's attached we don't have to scan all of it"""
+        cache_file = self._prefix_with_slash + INDEX_CACHE_FILE
+        cache = {"version": INDEX_CACHE_VERSION, "prefix": self.prefix, "index": self.index}
+        # No indent, nobody is going to read this by hand
+        try:
+            data = orjson.dumps(cache) if orjson is not None else None
+        except TypeError:
+            # orjson won't take file names that aren't valid UTF-8, which scandir() hands us as surrogate escapes
+            data = None
+        try:
+            if data is None:
+                # json escapes anything that isn't ASCII, surrogates included
+                data = json.dumps(cache, separators=(",", ":")).encode()
+            # Write then rename, so a crash part way through can't leave a broken cache behind
+            with open(cache_file + ".tmp", "wb") as file:
+                file.write(data)
+            os.replace(cache_file + ".tmp", cache_file)
+        except (OSError, TypeError, ValueError):
+            # Read only, full, or something in the index we can't save. We'll just have to do a
+            # full scan next time. This runs on detach, so it must never stop the drive unmounting.
+            try:
+                os.remove(cache_file + ".tmp")
+            except OSError:
+                pass
+
+    def _refresh_from_cache(self) -> bool:
+        """Refresh the index from the one saved by _save_index_cache(), only scanning folders that changed
+
+        A folder's mtime changes whenever something is added to, removed from, or renamed in it,
+        so if it matches what we saved, the saved contents are still good. Files that were only
+        written to since won't show it until the next full refresh_index().
+        Returns False if there's no usable saved index.
+        """
+        try:
+            with open(self._prefix_with_slash + INDEX_CACHE_FILE, "rb") as file:
+                data = file.read()
+        except OSError:
+            return False
+        try:
+            cache = orjson.loads(data) if orjson is not None else json.loads(data)
+        except ValueError:
+            try:
+                # orjson won't read the escaped surrogates json writes for non UTF-8 file names
+                cache = json.loads(data)
+            except ValueError:
+                return False
+        if not isinstance(cache, dict) or cache.get("version") != INDEX_CACHE_VERSION or cache.get("prefix") != self.prefix:
+            return False
+        try:
+            output, by_path = self._load_cached_tree(cache["index"])
+        except (KeyError, TypeError, AttributeError, ValueError):
+            # Anyone can write to the drive, so don't trust the saved index to be in one piece
+            return False
+        self.index = output
+        self._by_path = by_path
+        self.index_time = time.time()
+        self._fill_mime()
+        return True
+
+    def _load_cached_tree(self, index: dict) -> tuple:
+        """Rebuild the index from a saved one, scanning folders whose mtime changed
+
+        Returns the same as _scan(). Raises ValueError if a saved node doesn't make sense, and
+        probably KeyError, TypeError or AttributeError if the saved index is mangled.
+        """
+        output = {}
+        by_path = {}
+        # (path, contents to fill, saved node for that folder). Always rescan the top level,
+        # since saving the cache changed it.
+        folders = [(self.prefix, output, {"mtime": None, "contents": index})]
+        while len(folders) > 0:
+            path, contents, saved = folders.pop()
+            try:
+                mtime = os.stat(path, follow_symlinks=False).st_mtime
+            except OSError:
+                mtime = None
+            if saved is not None and mtime is not None and saved["mtime"] == mtime:
+                base = path if path.endswith("/") else path + "/"
+                for name, node in saved["contents"].items():
+                    self._check_cached_node(node, base, name)
+                    contents[name] = node
+                    by_path[node["path"][self._prefix_len:]] = node
+                    if node["type"] == "dir":
+                        # Sub-folders may have changed even if this one didn't
+                        old = {"mtime": node["mtime"], "contents": node["contents"]}
+                        node["contents"] = {}
+                        folders.append((node["path"], node["contents"], old))
+            else:
+                sub_folders = self._scan_folder(path, contents, by_path)
+                saved_contents = saved["contents"] if saved is not None else {}
+                # Files that are still here keep their access points
+                for name, node in contents.items():
+                    old = saved_contents.get(name)
+                    if old is not None and old["type"] == "file" == node["type"] and isinstance(old["access_count"], int):
+                        node["access_count"] = old["access_count"]
+                for sub_path, sub_contents in sub_folders:
+                    old = saved_contents.get(os.path.basename(sub_path))
+                    if old is not None and old["type"] != "dir":
+                        old = None
+                    folders.append((sub_path, sub_contents, old))
+        return output, by_path
+
+    def _check_cached_node(self, node: dict, base: str, name: str) -> None:
+        """Make sure a node from a saved index is what a scan of base would have made for name
+
+        Raises ValueError if not. Otherwise a saved index could point file operations anywhere on the system.
+        """
+        if "/" in name or name in ("", ".", "..") or node["path"] != base + name:
+            raise ValueError(f"Saved index has a bad path for {base + name}")
+        if node["type"] == "dir":
+            if not isinstance(node["contents"], dict):
+                raise ValueError(f"Saved index has bad contents for {base + name}")
+        elif node["type"] == "file":
+            if not isinstance(node["size"], int) or not isinstance(node["access_count"], int):
+                raise ValueError(f"Saved index has bad stats for {base + name}")
+        else:
+            raise ValueError(f"Saved index has an unknown type for {base + name}")
 
+    def _fill_mime(self) -> None:
+        """Queue up MIME detection for every file in the index that doesn't have a type yet
+
+        Detection runs on _mime_pool, in batches of MIME_BATCH files. Each thread there has its own
+        magic.Magic, and libmagic doesn't hold the GIL, so this scales with index_workers.
+        """
+        # Anything still queued from last time is for an index we've thrown away
+        for each in self._mime_futures:
+            each.cancel()
+        # Copy the items, since files can be added or removed on another thread while we work
+        self._mime_pending = {rel for rel, node in list(self._by_path.items())
+                              if node["type"] == "file" and node.get("file_type") is None}
+        pending = list(self._mime_pending)
+        self._mime_futures = [self._mime_pool.submit(self._detect_mime_batch, pending[each:each + MIME_BATCH])
+                              for each in range(0, len(pending), MIME_BATCH)]
+
+    def _detect_mime_batch(self, paths: list) -> None:
+        """Fill in the MIME type for each relative path given"""
+        for each in paths:
+            self._detect_mime(each)
+
+    def _get_magic(self) -> magic.Magic:
+        """Get the magic.Magic instance for this thread
+
+        A magic.Magic can only be used by one thread at a time, so each thread gets its own.
+        """
+        try:
+            return self._mime.magic
+        except AttributeError:
+            self._mime.magic = magic.Magic(mime=True)
+            return self._mime.magic
+
+    def _detect_mime(self, rel: str) -> None:
+        """Fill in the MIME type for the file at a relative path, if it hasn't been already"""
+        if rel not in self._mime_pending:
+            return
+        node = self._by_path.get(rel)
+        if node is not None:
+            try:
+                # There are only a handful of distinct MIME types, so share one copy of each
+                # string between every node instead of keeping one per file
+                node["file_type"] = sys.intern(self._get_magic().from_file(node["path"]))
+            except OSError:
+                node["file_type"] = None
+        self._mime_pending.discard(rel)
 
     def _get_relative_path(self, path):
         """Convert absolute to relative path"""
-        if self.prefix != path[:len(self.prefix)]:
-            if path[0] == "/":
-                return path[1:]
-            return path
-        return path[(len(self.prefix) + 1):]
+        if path.startswith(self._prefix_with_slash):
+            return path[self._prefix_len:]
+        if path == self.prefix:
+            return ""
+        if path.startswith("/"):
+            return path[1:]
+        return path
 
 
     def get_node(self, location):
         """Get info about location"""
-        new_loc = self._get_relative_path(location)
-        folder_list = new_loc.split("/")
-        current_dict = copy.deepcopy(self.index)
-        count = 1
-        for folder in folder_list:
-            if folder in current_dict:
-                if count < len(folder_list):
-                    if "contents" in current_dict[folder].keys():
-                        current_dict = current_dict[folder]["contents"]
-                    else:
-                        raise FileNotFoundError(f"File {location} does not exist")
-                else:
-                    return current_dict[folder]
-            else:
-                raise FileNotFoundError(f"File {location} does not exist")
-            count += 1
-
+        rel = self._get_relative_path(location)
+        try:
+            node = self._by_path[rel]
+        except KeyError:
+            raise FileNotFoundError(f"File {location} does not exist") from None
+        self._detect_mime(rel)
+        return node
+
+    def _index_paths(self, contents: dict) -> dict:
+        """Build a {relative path: node} lookup table for everything in contents, and under it"""
+        output = {}
+        folders = [contents]
+        while len(folders) > 0:
+            for each in folders.pop().values():
+                output[self._get_relative_path(each["path"])] = each
+                if each["type"] == "dir":
+                    folders.append(each.get("contents", {}))
+        return output
 
     def _set_index(self, index: dict):
         """Manually apply an index"""
         # check index before applying. Throw error if something wrong
         self.index = copy.deepcopy(index)
+        self._by_path = self._index_paths(self.index)
+        self._fill_mime()
+
+    def _resolve(self, path: str) -> tuple:
+        """Look up a node, the contents of its parent folder, its name, and its relative path, all at once
 
-    def open_file(self, file_path: str) -> _io.TextIOWrapper:
+        The node is None if it isn't in the index. Raises FileNotFoundError if the parent folder isn't either.
+        """
+        rel = self._get_relative_path(path)
+        # One pass over the string, no list to build
+        parent_rel, _, name = rel.rpartition("/")
+        if parent_rel == "":
+            parent = self.index
+        else:
+            try:
+                parent = self._by_path[parent_rel]["contents"]
+            except KeyError:
+                raise FileNotFoundError(f"Folder {parent_rel} does not exist") from None
+        return self._by_path.get(rel), parent, name, rel
+
+    def open_file(self, file_path: str) -> _io.BufferedRandom:
         """Open a file for reading/writing to"""
-        new_loc = self._get_relative_path(file_path)
-        if not self.check_file_exists(new_loc):
-            raise FileNotFoundError(f"File {new_loc} does not exist.")
-        self.get_node(file_path)["access_count"] += 1
-        return open(new_loc, "b+")
+        node = self._resolve(file_path)[0]
+        if node is None:
+            raise FileNotFoundError(f"File {file_path} does not exist.")
+        node["access_count"] += 1
+        return open(node["path"], "rb+")
 
     def delete_file(self, file_path: str) -> None:
         """Delete a file"""
-        new_loc = self._get_relative_path(file_path)
-        if not self.check_file_exists(new_loc):
+        node, parent, name, rel = self._resolve(file_path)
+        if node is None:
             raise FileNotFoundError(f"File {file_path} does not exist.")
-        os.remove(file_path)
-
-        # we now need to remove the node from the index
-        # Get parent index
-        new_path = "/".join(new_loc.split("/")[:-1])
-        parent_node = self.get_node(new_path)
-        file_name = new_loc.split("/")[-1]
+        os.remove(node["path"])
+        self._remove_node(parent, name, rel)
 
-        # Due to Python's pass-by-refrence nature, parent_node points to the location of file_name's parent in the index
+    def _remove_node(self, parent: dict, name: str, rel: str) -> None:
+        """Remove a node from the index, given what _resolve() found for it"""
+        # Due to Python's pass-by-refrence nature, parent points to the location of name's parent in the index
         # If you delete this pointer, it only deletes the pointer, nothing below it. Like how a symbolic link works.
         # However, you can easily go inside the parent node and delete things from the index from there.
-        del parent_node[file_name]
+        node = parent.pop(name)
+        del self._by_path[rel]
+        self._mime_pending.discard(rel)
+        if node["type"] == "dir":
+            for each in self._index_paths(node.get("contents", {})):
+                self._by_path.pop(each, None)
+                self._mime_pending.discard(each)
         self.index_time = time.time()
 
-    def _create_new_node(self, file_path: str) -> None:
-        """Create a new node in the index"""
-        # we now need to remove the node from the index
-        # Get parent index
-        new_path = "/".join(new_loc.split("/")[:-1])
-        parent_node = self.get_node(new_path)
-        file_name = new_loc.split("/")[-1]
-        parent_node[file_name] = {"path": file_path}
-        try:
-            os.listdir(file_path)
-            parent_node[file_name]["type"] = "dir"
-        except NotADirectoryError:
-            parent_node[file_name]["type"] = "file"
-            parent_node[file_name]["file_type"] = magic.from_file(file_path, mime=True)
-        try:
-            stat = os.stat(output[each1]["path"])
-        except FileNotFoundError:
-            stat = [None] * 10
-        parent_node[file_name]["uid"] = stat[4]
-        parent_node[file_name]["gid"] = stat[5]
-        parent_node[file_name]["atime"] = stat[7]
-        parent_node[file_name]["mtime"] = stat[8]
-        parent_node[file_name]["ctime"] = stat[9]
-        parent_node[file_name]["access_count"] = 0
+    def _create_new_node(self, file_path: str) -> dict:
+        """Create a new node in the index, and return it"""
+        parent, name, rel = self._resolve(file_path)[1:]
+        abs_path = self._prefix_with_slash + rel
+        # One stat() tells us everything, including whether this is a folder
+        info = os.stat(abs_path, follow_symlinks=False)
+        node = {"path": abs_path,
+                "size": info.st_size,
+                "uid": info.st_uid,
+                "gid": info.st_gid,
+                "atime": info.st_atime,
+                "mtime": info.st_mtime,
+                "ctime": info.st_ctime}
+        if stat.S_ISDIR(info.st_mode):
+            node["type"] = "dir"
+            node["contents"] = {}
+        else:
+            node["type"] = "file"
+            node["file_type"] = None
+            self._mime_pending.add(rel)
+        node["access_count"] = 0
+        parent[name] = node
+        self._by_path[rel] = node
 
         # new node created. Update self.index_time
         self.index_time = time.time()
+        return node
 
-    def make_new_file(self, file_path: str) -> _io.TextIOWrapper:
+    def refresh_node(self, file_path: str) -> None:
+        """Update a file's node from disk, such as once something has finished writing to it"""
+        node, rel = self._resolve(file_path)[::3]
+        if node is None:
+            raise FileNotFoundError(f"File {file_path} does not exist.")
+        info = os.stat(node["path"], follow_symlinks=False)
+        node.update({"size": info.st_size,
+                     "uid": info.st_uid,
+                     "gid": info.st_gid,
+                     "atime": info.st_atime,
+                     "mtime": info.st_mtime,
+                     "ctime": info.st_ctime})
+        if node["type"] == "file":
+            # Whatever we worked out before was for the old contents
+            node["file_type"] = None
+            self._mime_pending.add(rel)
+
+    def make_new_file(self, file_path: str) -> _io.BufferedWriter:
         """Create a new file"""
-        new_loc = self._get_relative_path(file_path)
-        self._create_new_node(file_path)
-        return open(new_loc, "xb")
+        abs_path = self._prefix_with_slash + self._get_relative_path(file_path)
+        # Make the file before indexing it, so the node gets real stats
+        file = open(abs_path, "xb")
+        try:
+            self._create_new_node(file_path)
+        except BaseException:
+            file.close()
+            os.remove(abs_path)
+            raise
+        return file
 
     def copy_file(self, source_path: str, dest_path: str):
         """Copy a file from one place to another"""
-        source = self._get_relative_path(source_path)
-        dest = self._get_relative_path(dest_path)
-        if not self.check_file_exists(source):
-            raise FileNotFoundError(f"File {source} does not exist.")
+        node = self._resolve(source_path)[0]
+        if node is None:
+            raise FileNotFoundError(f"File {source_path} does not exist.")
         # copy file
         try:
-            shutil.copy(source, dest)
+            shutil.copy(node["path"], self._prefix_with_slash + self._get_relative_path(dest_path))
         except PermissionError:
             return False
         self._create_new_node(dest_path)
@@ -281,24 +554,58 @@ class Interface():
 
     def move_file(self, source_path: str, dest_path: str):
         """Move a file from one place to another"""
+        node = self._resolve(source_path)[0]
+        if node is None:
+            raise FileNotFoundError(f"File {source_path} does not exist.")
         if self.copy_file(source_path, dest_path):
-            self.get_node(dest_path)["access_count"] = self.get_node(source_path)["access_count"] + 1
+            self._resolve(dest_path)[0]["access_count"] = node["access_count"] + 1
             self.delete_file(source_path)
         else:
             raise OSError(f"An error has occured moving file {source_path} to {dest_path}. Keeping original.")
 
+    def rename(self, source_path: str, dest_path: str) -> None:
+        """Move a file to somewhere else on this drive, without copying it"""
+        node, parent, name, rel = self._resolve(source_path)
+        if node is None:
+            raise FileNotFoundError(f"File {source_path} does not exist.")
+        # Make sure the destination's folder is in the index before touching anything on disk,
+        # so we can't end up with the file moved but missing from the index
+        dest_rel = self._resolve(dest_path)[3]
+        if dest_rel == rel:
+            # Already there. Carrying on would replace the node, then remove it.
+            return
+        dest = self._prefix_with_slash + dest_rel
+        os.rename(node["path"], dest)
+        try:
+            new_node = self._create_new_node(dest_path)
+        except BaseException:
+            os.rename(dest, node["path"])
+            raise
+        self._remove_node(parent, name, rel)
+        new_node["access_count"] = node["access_count"] + 1
+
     def check_file_exists(self, file_path: str) -> bool:
         """Check file exists on disk"""
-        # This is here to provide a faster function for this later on
         # we can't use os.path.exists() for this, in case there is a false positive
+        # Not using get_node(), it would go and work out the MIME type, which we don't need here
+        return self._get_relative_path(file_path) in self._by_path
+
+    def probe(self, file_path: str, free=True) -> dict:
+        """Check if a file exists, get its node, and get free space, all in one call
+
+        Set free=False to skip checking free space, in which case "free" will be None.
+        """
         try:
-            self.get_node(file_path)
-            return True
+            node = self.get_node(file_path)
         except FileNotFoundError:
-            return False
+            node = None
+        return {"exists": node is not None, "free": self.get_free() if free else None, "node": node}
 
     def detach(self):
         """Unmount drive and remove mountpoint if necessary"""
+        # No point finishing MIME detection on a drive we're unmounting
+        self._mime_pool.shutdown(wait=True, cancel_futures=True)
+        self._save_index_cache()
         try:
             subproc.check_call(["umount", self.prefix])
         except CalledProcessError:
@@ -311,44 +618,33 @@ class Interface():
         """Get size of drive"""
         try:
             return self.size
-        except UnboundLocalError:
+        except AttributeError:
             self.calc_size()
             return self.size
 
     def calc_size(self):
         """Calculate size of device"""
-        size = json.loads(subproc.check_output(["lsblk", "--json", "--bytes", "--output", "fsize"]))["blockdevices"]["size"]
-        self.size = size / 1024**2
+        # statvfs() is one syscall, where lsblk is a whole process
+        info = os.statvfs(self.prefix)
+        self.size = (info.f_blocks * info.f_frsize) / 1024**2
         self.units = "m"
 
     def get_used(self):
         """Get amount of drive used"""
-        size = json.loads(subproc.check_output(["lsblk", "--json", "--bytes", "--output", "fsused"]))["blockdevices"]["size"]
-        return size / 1024**2
+        info = os.statvfs(self.prefix)
+        return ((info.f_blocks - info.f_bfree) * info.f_frsize) / 1024**2
 
     def get_free(self):
         """Get amount of free space on drive"""
-        return self.size - self.get_used()
+        info = os.statvfs(self.prefix)
+        return (info.f_bavail * info.f_frsize) / 1024**2
 
     def drop_access_points(self):
         """Drop access points on everything by 1"""
-        def get_files(data):
-            files = []
-
-            def _traverse(node):
-                if "contents" in node:
-                    for each in node["contents"]:
-                        if each["type"] == "file":  # If it's an empty dict, it's a file
-                            files.append(each)
-                        else:
-                            _traverse(each)
-
-            _traverse(data)
-            return files
-
-        files = get_files(self.drives)
-        for each in files:
-            each["access_count"] -= 1
+        # Copy the values, since files can be added or removed on another thread while we work
+        for each in list(self._by_path.values()):
+            if each["type"] == "file":
+                each["access_count"] -= 1
 
 
 
@@ -29,10 +29,12 @@ import tiers.fs_interface.etc as etc
 
 class Interface(etc.Interface):
     """Create and manage a RAMDisk"""
-    def __init__(self, size: int, unit: str, mount_point: str) -> None:
-        """Create the RAM disk and mount it"""
-        if not os.path.exists(mount_point):
-            etc.recursive_mkdir(mount_point)
+    def __init__(self, size: int, unit: str, mount_point: str, index_workers=1) -> None:
+        """Create the RAM disk and mount it
+
+        index_workers defaults to 1, since indexing a RAM disk is never waiting on anything, so threads would just add overhead.
+        """
+        os.makedirs(mount_point, exist_ok=True)
         use_unit =""
         if unit.lower() in ("m", "mb", "mib", "megabytes"):
             use_unit = "m"
@@ -44,7 +46,7 @@ class Interface(etc.Interface):
         self.size = size
         self.drive = "pytierfs-ramdisk"
         # Do not index the drive, as it will be empty. No point.
-        super().__init__(self.drive, mount_point, index=False)
+        super().__init__(self.drive, mount_point, index=False, index_workers=index_workers)
 
     def calc_size(self):
         """Override getting size from kernel since we already know it.
@@ -63,3 +65,7 @@ class Interface(etc.Interface):
         """This just needs to always return None"""
         pass
 
+    def _save_index_cache(self):
+        """RAM disks are wiped when unmounted, so there's no point saving the index"""
+        pass
+
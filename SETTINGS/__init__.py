@@ -26,6 +26,24 @@ import json
 import os
 import warnings
 import psutil
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+def _loads(data: bytes):
+    """Parse JSON, with orjson if it's installed, since it's a lot faster"""
+    if orjson is not None:
+        return orjson.loads(data)
+    return json.loads(data)
+
+
+def _dumps(obj) -> bytes:
+    """Serialize to indented JSON, with orjson if it's installed"""
+    if orjson is not None:
+        return orjson.dumps(obj, option=orjson.OPT_INDENT_2)
+    return json.dumps(obj, indent=2).encode()
 
 
 class Settings():
@@ -38,6 +56,7 @@ class Settings():
                     "size": round((psutil.virtual_memory().total / 2) / (1024 ** 2)), # allocate half of all memory to our RAM disk. This might be adjusted in the future
                     "units": "mb",
                     "nickname": "PyTierFS-RAMDISK",
+                    "index_workers": 1, # number of threads to index this drive with. Leave out to use 4 per CPU core. RAM is fast enough that threads don't help
                     "volatile": True # easy marker if something is a RAMDisk or RAMDisk-like object, without having to check names
                 }
         },
@@ -111,37 +130,45 @@ class Settings():
 }
         if not os.path.exists(settings_file):
             warnings.warn(f"Settings file {settings_file} not found. Making new one...", ResourceWarning)
-            with open(settings_file, "w+") as file:
-                json.dump(self.default_settings, file, indent=2)
+            with open(settings_file, "wb") as file:
+                file.write(_dumps(self.default_settings))
         self.settings_file = settings_file
-        with open(settings_file, "r") as file:
-            self.settings = json.load(file)
+        # Parse the bytes directly, which skips decoding through a text file object
+        with open(settings_file, "rb") as file:
+            self.settings = _loads(file.read())
+        # These get looked at a lot, so only look them up once
+        self._drives = self.settings["DRIVES"]
+        self._tiers_by = self.settings["TIERS"]["by_tier"]
+        self._global_tier = self.settings["TIERS"]["global"]
 
     def get_drive_settings(self, drive: str) -> dict:
         """Return settings for a given drive"""
-        if drive not in self.settings["DRIVES"]:
-            raise KeyError(f"Drive {drive} is not configured.")
-        return self.settings["DRIVES"][drive]
+        try:
+            return self._drives[drive]
+        except KeyError:
+            raise KeyError(f"Drive {drive} is not configured.") from None
 
     def get_tier_settings(self, tier: str) -> dict:
         """Return settings for a given drive"""
-        if tier not in self.settings["TIERS"]["by_tier"]:
-            raise KeyError(f"Tier {tier} is not configured.")
-        return self.settings["TIERS"]["by_tier"][tier]
+        try:
+            return self._tiers_by[tier]
+        except KeyError:
+            raise KeyError(f"Tier {tier} is not configured.") from None
 
     def get_tier_settings_global(self, key: str):
-        if key not in self.settings["TIERS"]["global"]:
-            raise KeyError(f"Global tier setting {key} is not available. Keys: { self.settings['TIERS']['global'].keys() }")
-        return self.settings['TIERS']['global'][key]
+        try:
+            return self._global_tier[key]
+        except KeyError:
+            raise KeyError(f"Global tier setting {key} is not available. Keys: { self._global_tier.keys() }") from None
 
     def set_drive_settings(self, drive: str, key: str, value) -> bool:
         """Set a setting for a drive
 
             True if successful, false if failed
         """
-        if drive not in self.settings["DRIVES"]:
+        if drive not in self._drives:
             return False
-        if key.lower() not in self.settings["DRIVES"][drive]:
+        if key.lower() not in self._drives[drive]:
             return False
         if key.lower() == "mount_point":
             if not os.path.exists(value):
@@ -152,7 +179,7 @@ class Settings():
         if key.lower() == "tier":
             if type(value) not in (int, None):
                 return False
-        self.settings["DRIVES"][drive][key.lower()] = value
+        self._drives[drive][key.lower()] = value
         return True
 
     def add_drive_to_settings(self, drive: str, reset=False) -> bool:
@@ -166,15 +193,15 @@ class Settings():
             Returns True if successful, else False.
         """
         default_settings = {
-                "mount_point": f"/mnt/pytierfs/drive{ len(self.settings["DRIVES"]) }",
+                "mount_point": f"/mnt/pytierfs/drive{ len(self._drives) }",
                 "tier": None,
-                "nickname": f"drive{ len(self.settings["DRIVES"]) }"
+                "nickname": f"drive{ len(self._drives) }"
             }
-        if drive in self.settings["DRIVES"] and not reset:
+        if drive in self._drives and not reset:
             return False
         if not os.path.exists(drive):
             return False
-        self.settings["DRIVES"][drive] = default_settings
+        self._drives[drive] = default_settings
         try:
             self.write_settings_to_disk()
         except (PermissionError, IOError, FileNotFoundError):
@@ -183,6 +210,6 @@ class Settings():
 
     def write_settings_to_disk(self):
         """Write settings to disk"""
-        with open(self.settings_file, "w") as file:
-            json.dump(self.settings, file, indent=2)
+        with open(self.settings_file, "wb") as file:
+            file.write(_dumps(self.settings))
 